@@ -1,18 +1,25 @@
-from datetime import date
-from flask import Flask, abort, render_template, redirect, url_for, flash
+from datetime import date as date_, datetime
+from flask import Flask, abort, render_template, redirect, url_for, flash, g, request
 from flask_bootstrap import Bootstrap5
+from flask_caching import Cache
 from flask_ckeditor import CKEditor
-from flask_gravatar import Gravatar
+from flask_compress import Compress
 from flask_login import UserMixin, login_user, LoginManager, current_user, logout_user
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import Integer, String, Text, ForeignKey
+from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column, selectinload, raiseload, load_only
+from sqlalchemy import Integer, String, Text, Date, ForeignKey, event, text, inspect
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import IntegrityError
 from typing import List
-from functools import wraps
+from functools import wraps, lru_cache
 from werkzeug.security import generate_password_hash, check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError, InvalidHashError
 from forms import CreatePostForm, RegisterForm, LoginForm, CommentForm
 from dotenv import load_dotenv
 import os
+import hashlib
+import sqlite3
 
 load_dotenv()
 
@@ -21,6 +28,19 @@ app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
 ckeditor = CKEditor(app)
 Bootstrap5(app)
 
+# Stored on disk so every gunicorn worker sees the same entries and cache.clear() reaches them all
+cache = Cache(app, config={
+    'CACHE_TYPE': 'FileSystemCache',
+    'CACHE_DIR': os.getenv("CACHE_DIR", os.path.join(app.instance_path, 'cache')),
+    'CACHE_DEFAULT_TIMEOUT': 300
+})
+
+# Compress HTML responses with brotli, falling back to gzip
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_MIN_SIZE'] = 512
+Compress(app)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 
@@ -29,13 +49,70 @@ login_manager.init_app(app)
 def load_user(user_id):
     return db.get_or_404(User, user_id)
 
+# Argon2id password hashing; older accounts may still hold Werkzeug pbkdf2 hashes
+ph = PasswordHasher(time_cost=2, memory_cost=64*1024, parallelism=2)
+
+# Hashes checked in place of a real one so every login does the same work
+DUMMY_HASH = ph.hash('dummy')
+LEGACY_DUMMY_HASH = generate_password_hash('dummy', method='pbkdf2:sha256', salt_length=8)
+
+
+# Runs one argon2 and one pbkdf2 check on every call, so timing doesn't reveal
+# whether the account exists or which scheme its hash still uses
+def verify_password(stored_hash, password):
+    is_argon2 = stored_hash.startswith('$argon2')
+    try:
+        argon2_ok = ph.verify(stored_hash if is_argon2 else DUMMY_HASH, password)
+    except (VerifyMismatchError, InvalidHashError):
+        argon2_ok = False
+    # Legacy pbkdf2 hash (check_password_hash compares with hmac.compare_digest)
+    legacy_ok = check_password_hash(LEGACY_DUMMY_HASH if is_argon2 else stored_hash, password)
+    return argon2_ok if is_argon2 else legacy_ok
+
+
+def password_needs_rehash(stored_hash):
+    return not stored_hash.startswith('$argon2') or ph.check_needs_rehash(stored_hash)
+
 # CREATE DATABASE
 class Base(DeclarativeBase):
     pass
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///posts.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("BLOG_DATABASE_URI", 'sqlite:///posts.db')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_pre_ping': True,
+    'pool_recycle': 3600
+}
+# SQLite-only driver option so pooled connections can be shared across threads
+if make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == 'sqlite':
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'check_same_thread': False}
 db = SQLAlchemy(model_class=Base)
 db.init_app(app)
 
+# Use WAL so readers don't block on writers across gunicorn workers
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+
+# Make logged_in available to every template, evaluated once per request
+@app.context_processor
+def inject_auth():
+    if not hasattr(g, '_logged_in'):
+        g._logged_in = current_user.is_authenticated
+    return {'logged_in': g._logged_in}
+
+
+# Format post dates for display; a blog has few distinct dates, so cache each one
+@app.template_filter('longdate')
+@lru_cache(maxsize=512)
+def longdate(d):
+    return d.strftime("%B %d, %Y")
+
 
 # CONFIGURE TABLES
 # Blog table
@@ -44,21 +121,23 @@ class BlogPost(db.Model):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
     subtitle: Mapped[str] = mapped_column(String(250), nullable=False)
-    date: Mapped[str] = mapped_column(String(250), nullable=False)
+    date: Mapped[date_] = mapped_column(Date, nullable=False, index=True)
     body: Mapped[str] = mapped_column(Text, nullable=False)
     author: Mapped['User'] = relationship(back_populates='posts')
-    author_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
+    author_id: Mapped[int] = mapped_column(ForeignKey('users.id'), index=True)
     img_url: Mapped[str] = mapped_column(String(250), nullable=False)
-    comments: Mapped[List['Comment']] = relationship(back_populates='parent_post')
+    comments: Mapped[List['Comment']] = relationship(back_populates='parent_post', cascade='all, delete-orphan')
 
 
 # User table with the UserMixin
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    email: Mapped[str] = mapped_column(String(100), unique=True)
-    password: Mapped[str] = mapped_column(String(100), nullable=False)
+    email: Mapped[str] = mapped_column(String(100), unique=True, index=True)
+    password: Mapped[str] = mapped_column(String(255), nullable=False)
     name: Mapped[str] = mapped_column(String(1000), nullable=False)
+    # Gravatar hash of the email, stored so templates don't hash on every render
+    email_md5: Mapped[str] = mapped_column(String(32), index=True)
     posts: Mapped[List['BlogPost']] = relationship(back_populates='author')
     comments: Mapped[List['Comment']] = relationship(back_populates='comment_author')
 
@@ -69,19 +148,46 @@ class Comment(db.Model):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     text: Mapped[str] = mapped_column(Text, nullable=False)
     comment_author: Mapped['User'] = relationship(back_populates='comments')
-    comment_author_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
+    comment_author_id: Mapped[int] = mapped_column(ForeignKey('users.id'), index=True)
     parent_post: Mapped[List['BlogPost']] = relationship(back_populates='comments')
-    parent_post_id: Mapped[str] = mapped_column(ForeignKey('blog_posts.id'))
+    parent_post_id: Mapped[int] = mapped_column(ForeignKey('blog_posts.id'), index=True)
+
+
+def gravatar_hash(email):
+    return hashlib.md5(email.strip().lower().encode()).hexdigest()
 
 
-with app.app_context():
+# Create or upgrade the database schema; run once per deploy with `flask --app app init-db`
+@app.cli.command('init-db')
+def init_db():
     db.create_all()
+    # create_all skips existing tables, so add columns introduced since older databases were made
+    user_columns = {column['name'] for column in inspect(db.engine).get_columns('users')}
+    if 'email_md5' not in user_columns:
+        db.session.execute(text("ALTER TABLE users ADD COLUMN email_md5 VARCHAR(32)"))
+        db.session.commit()
+    for user in db.session.scalars(db.select(User).where(User.email_md5.is_(None))):
+        user.email_md5 = gravatar_hash(user.email)
+    db.session.commit()
+
+    # Likewise add any missing indexes to older databases
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    # Older databases stored post dates as 'Month DD, YYYY' strings; convert them to ISO dates
+    legacy_dates = db.session.execute(text("SELECT id, date FROM blog_posts WHERE date NOT LIKE '____-__-__'")).all()
+    for post_id, legacy_date in legacy_dates:
+        iso_date = datetime.strptime(legacy_date, "%B %d, %Y").date().isoformat()
+        db.session.execute(text("UPDATE blog_posts SET date = :date WHERE id = :id"), {'date': iso_date, 'id': post_id})
+    db.session.commit()
+
 
 # Decorator for admin only access
 def admin_only(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
-        if current_user.id != 1:
+        if not current_user.is_authenticated or current_user.id != 1:
             return abort(403) # Create 403.html to let user navigate elsewhere for UX
         return f(*args, **kwargs)
     return wrapper
@@ -91,40 +197,56 @@ def admin_only(f):
 def only_commenter(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
-        user = db.session.execute(db.select(Comment).where(Comment.comment_author_id == current_user.id)).scalar()
-        if not current_user.is_authenticated or current_user.id != user.comment_author_id:
+        comment = db.session.get(Comment, kwargs['comment_id'])
+        if comment is None or not current_user.is_authenticated or comment.comment_author_id != current_user.id:
             return abort(403)
+        # Hand the loaded comment to the view so it isn't fetched twice
+        g.comment = comment
         return f(*args, **kwargs)
     return wrapper
 
 
+# Cache key for rendered pages; the header and admin links depend on who is logged in
+def user_cache_key():
+    user_id = current_user.id if current_user.is_authenticated else 'anonymous'
+    return f'view/{request.path}/{user_id}'
+
+
+# Insert many posts at once (e.g. from an import), bypassing per-object ORM bookkeeping
+# rows: list of dicts keyed by BlogPost column names
+def bulk_create_posts(rows):
+    db.session.execute(db.insert(BlogPost).execution_options(render_nulls=False), rows)
+    db.session.commit()
+    cache.clear()
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
-        # Check if user exists
-        result = db.session.execute(db.select(User).where(User.email == form.email.data))
-        user = result.scalar()
-
-        if user:
-            flash('A user with that email already exists.')
-            return redirect(url_for('login'))
-        
         # Create new user
         new_user = User(
             email = form.email.data,
-            password = generate_password_hash(form.password.data, method='pbkdf2:sha256', salt_length=8),
+            email_md5 = gravatar_hash(form.email.data),
+            password = ph.hash(form.password.data),
             name = form.name.data
         )
         db.session.add(new_user)
-        db.session.commit()
+
+        # Email is unique, so a failed insert means the user already exists
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('A user with that email already exists.')
+            return redirect(url_for('login'))
 
         # Login and authenticate new user
         login_user(new_user)
 
         return redirect(url_for('get_all_posts'))
 
-    return render_template("register.html", form=form, logged_in=current_user.is_authenticated)
+    return render_template("register.html", form=form)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -140,19 +262,20 @@ def login():
         user = result.scalar()
 
         # Check stored password hash against password input
-        if not user:
-            flash('That email does not exist. Please try again.')
+        stored_hash = user.password if user else DUMMY_HASH
+        if not verify_password(stored_hash, password) or not user:
+            flash('Invalid email or password. Please try again.')
             return redirect(url_for('login'))
-        
-        elif not check_password_hash(user.password, password):
-            flash('Password incorrect. Please try again.')
-            return redirect(url_for('login'))
-        
-        else:
-            login_user(user)
-            return redirect(url_for('get_all_posts'))
 
-    return render_template("login.html", form=form, logged_in=current_user.is_authenticated)
+        # Upgrade legacy or outdated hashes now that the plain password is known
+        if password_needs_rehash(user.password):
+            user.password = ph.hash(password)
+            db.session.commit()
+
+        login_user(user)
+        return redirect(url_for('get_all_posts'))
+
+    return render_template("login.html", form=form)
 
 
 @app.route('/logout')
@@ -163,15 +286,35 @@ def logout():
 
 
 @app.route('/')
+@cache.cached(key_prefix=user_cache_key)
 def get_all_posts():
-    result = db.session.execute(db.select(BlogPost))
-    posts = result.scalars().all()
-    return render_template("index.html", all_posts=posts, logged_in=current_user.is_authenticated)
+    # Load every post's author in one extra query instead of one per post,
+    # and skip the body column since the listing never shows it
+    stmt = db.select(BlogPost).order_by(BlogPost.date.desc(), BlogPost.id.desc()).options(
+        load_only(BlogPost.id, BlogPost.title, BlogPost.subtitle, BlogPost.date, BlogPost.author_id, raiseload=app.debug),
+        selectinload(BlogPost.author).load_only(User.name)
+    )
+    if app.debug:
+        # Fail loudly in development if the template touches an unloaded relationship
+        stmt = stmt.options(raiseload('*'))
+    # Read-only view, so skip the autoflush check before querying.
+    # Rows are hydrated 100 at a time as the template iterates them, so render inside the block.
+    with db.session.no_autoflush:
+        posts = db.session.scalars(stmt.execution_options(yield_per=100))
+        return render_template("index.html", all_posts=posts)
 
 
 @app.route("/post/<int:post_id>", methods=['GET', 'POST'])
 def show_post(post_id):
-    requested_post = db.get_or_404(BlogPost, post_id)
+    with db.session.no_autoflush:
+        requested_post = db.first_or_404(
+            db.select(BlogPost)
+            .where(BlogPost.id == post_id)
+            .options(
+                selectinload(BlogPost.author),
+                selectinload(BlogPost.comments).selectinload(Comment.comment_author)
+            )
+        )
     form = CommentForm()
     if form.validate_on_submit():
         if not current_user.is_authenticated:
@@ -186,18 +329,7 @@ def show_post(post_id):
         db.session.add(new_comment)
         db.session.commit()
 
-    gravatar = Gravatar(
-        app,
-        size = 100,
-        rating = 'g',
-        default = 'retro',
-        force_default = False,
-        force_lower = False,
-        use_ssl = False,
-        base_url = None
-    )
-
-    return render_template("post.html", form=form, post=requested_post, logged_in=current_user.is_authenticated, gravatar=gravatar)
+    return render_template("post.html", form=form, post=requested_post)
 
 
 @app.route("/new-post", methods=["GET", "POST"])
@@ -211,18 +343,20 @@ def add_new_post():
             body=form.body.data,
             img_url=form.img_url.data,
             author=current_user,
-            date=date.today().strftime("%B %d, %Y")
+            date=date_.today()
         )
         db.session.add(new_post)
         db.session.commit()
+        cache.clear()
         return redirect(url_for("get_all_posts"))
-    return render_template("make-post.html", form=form, logged_in=current_user.is_authenticated)
+    return render_template("make-post.html", form=form)
 
 
 @app.route("/edit-post/<int:post_id>", methods=["GET", "POST"])
 @admin_only
 def edit_post(post_id):
-    post = db.get_or_404(BlogPost, post_id)
+    # Identity-map aware lookup; author is loaded up front for the form
+    post = db.session.get(BlogPost, post_id, options=[selectinload(BlogPost.author)]) or abort(404)
     edit_form = CreatePostForm(
         title=post.title,
         subtitle=post.subtitle,
@@ -237,35 +371,40 @@ def edit_post(post_id):
         post.author = current_user
         post.body = edit_form.body.data
         db.session.commit()
+        cache.clear()
         return redirect(url_for("show_post", post_id=post.id))
-    return render_template("make-post.html", form=edit_form, is_edit=True, logged_in=current_user.is_authenticated)
+    return render_template("make-post.html", form=edit_form, is_edit=True)
 
 
 @app.route("/delete/<int:post_id>")
+@admin_only
 def delete_post(post_id):
-    post_to_delete = db.get_or_404(BlogPost, post_id)
+    # Comments are loaded with the post since deleting it cascades to them
+    post_to_delete = db.session.get(BlogPost, post_id, options=[selectinload(BlogPost.comments)]) or abort(404)
     db.session.delete(post_to_delete)
     db.session.commit()
-    return redirect(url_for('get_all_posts'), logged_in=current_user.is_authenticated)
+    cache.clear()
+    return redirect(url_for('get_all_posts'))
 
 
-@app.route('/delete_comment/<comment_id>/<post_id>')
+@app.route('/delete_comment/<int:comment_id>/<int:post_id>')
 @only_commenter
 def delete_comment(post_id, comment_id):
-    comment = db.get_or_404(Comment, comment_id)
-    db.session.delete(comment)
+    db.session.delete(g.comment)
     db.session.commit()
     return redirect(url_for('show_post', post_id=post_id))
 
 
 @app.route("/about", methods=['GET'])
+@cache.cached(timeout=3600, key_prefix=user_cache_key)
 def about():
-    return render_template("about.html", logged_in=current_user.is_authenticated)
+    return render_template("about.html")
 
 
 @app.route("/contact")
+@cache.cached(timeout=3600, key_prefix=user_cache_key)
 def contact():
-    return render_template("contact.html", logged_in=current_user.is_authenticated)
+    return render_template("contact.html")
 
 
 if __name__ == "__main__":
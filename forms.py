@@ -4,31 +4,36 @@ from wtforms.validators import DataRequired, URL
 from flask_ckeditor import CKEditorField
 
 
+# Validators are stateless, so one instance is shared across every field
+_REQ = DataRequired()
+_URL = URL()
+
+
 # WTForm for creating a blog post
 class CreatePostForm(FlaskForm):
-    title = StringField("Blog Post Title", validators=[DataRequired()])
-    subtitle = StringField("Subtitle", validators=[DataRequired()])
-    img_url = StringField("Blog Image URL", validators=[DataRequired(), URL()])
-    body = CKEditorField("Blog Content", validators=[DataRequired()])
+    title = StringField("Blog Post Title", validators=[_REQ])
+    subtitle = StringField("Subtitle", validators=[_REQ])
+    img_url = StringField("Blog Image URL", validators=[_REQ, _URL])
+    body = CKEditorField("Blog Content", validators=[_REQ])
     submit = SubmitField("Post")
 
 
 # WTForm to register new users
 class RegisterForm(FlaskForm):
-    email = StringField('Email', [DataRequired()])
-    password = PasswordField('Password', [DataRequired()])
-    name = StringField('Name', [DataRequired()])
+    email = StringField('Email', [_REQ])
+    password = PasswordField('Password', [_REQ])
+    name = StringField('Name', [_REQ])
     submit = SubmitField('Sign Up')
 
 
 # WTForm to login user
 class LoginForm(FlaskForm):
-    email = StringField('Email', [DataRequired()])
-    password = PasswordField('Password', [DataRequired()])
+    email = StringField('Email', [_REQ])
+    password = PasswordField('Password', [_REQ])
     submit = SubmitField('Log in')
 
 
 # WTForm for creating comments on blogs
 class CommentForm(FlaskForm):
-    comment = CKEditorField('Comment', [DataRequired()])
+    comment = CKEditorField('Comment', [_REQ])
     submit = SubmitField('Comment')
@@ -0,0 +1,62 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # app.py reads its config at import time, so point it at a throwaway database and cache first
+    monkeypatch.setenv('BLOG_DATABASE_URI', f"sqlite:///{tmp_path / 'posts.db'}")
+    monkeypatch.setenv('SECRET_KEY', 'test')
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path / 'cache'))
+    sys.modules.pop('app', None)
+    import app as blog
+
+    blog.app.config['TESTING'] = True
+    result = blog.app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    # Debug mode turns on raiseload for the index query; set after init-db since the CLI resets it
+    blog.app.debug = True
+
+    # Each post gets its own author so a lazy author load can't be answered from the identity map
+    with blog.app.app_context():
+        for i in range(3):
+            email = f'author{i}@example.com'
+            author = blog.User(email=email, email_md5=blog.gravatar_hash(email),
+                               password=blog.ph.hash('password'), name=f'Author {i}')
+            post = blog.BlogPost(title=f'Post {i}', subtitle='Subtitle', date=date.today(), body='Body',
+                                 img_url='https://example.com/img.jpg', author=author)
+            blog.db.session.add(blog.Comment(text='Comment', comment_author=author, parent_post=post))
+        blog.db.session.commit()
+
+    yield blog, blog.app.test_client()
+
+    with blog.app.app_context():
+        blog.db.engine.dispose()
+
+
+# The index should need one query for posts and one for their authors, however many posts exist
+def test_index_query_count(client):
+    blog, test_client = client
+    statements = []
+
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with blog.app.app_context():
+        engine = blog.db.engine
+    event.listen(engine, 'before_cursor_execute', count_query)
+    try:
+        response = test_client.get('/')
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+
+    assert response.status_code == 200
+    # Posts from the same day are listed newest first
+    assert response.data.index(b'Post 2') < response.data.index(b'Post 0')
+    assert len(statements) <= 2, statements